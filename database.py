@@ -5,30 +5,42 @@ from typing import Optional
 
 DB_PATH = "bot_data.db"
 
+# 表结构（bot 与离线工具 db_tool.py 共用）
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS settings (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS cooldowns (
+        user_id INTEGER PRIMARY KEY,
+        last_time REAL
+    )
+    """,
+    # 存储聊天记录表
+    """
+    CREATE TABLE IF NOT EXISTS chat_history (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        chat_id INTEGER,
+        user_name TEXT,
+        message TEXT,
+        timestamp REAL
+    )
+    """,
+    # 按聊天室、按时间查询/清理历史，以及 db_tool.py 导入去重都依赖此索引
+    """
+    CREATE INDEX IF NOT EXISTS idx_chat_history_chat ON chat_history (chat_id, timestamp)
+    """,
+]
+
 async def init_db():
     async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS cooldowns (
-                user_id INTEGER PRIMARY KEY,
-                last_time REAL
-            )
-        """)
-        # 存储聊天记录表
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS chat_history (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER,
-                user_name TEXT,
-                message TEXT,
-                timestamp REAL
-            )
-        """)
+        # WAL 模式：离线导出/导入时不阻塞机器人读写
+        await db.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            await db.execute(statement)
         await db.commit()
 
 async def save_history(chat_id: int, user_name: str, message: str):
@@ -40,7 +52,7 @@ async def save_history(chat_id: int, user_name: str, message: str):
         )
         # 自动清理旧记录
         await db.execute(
-            "DELETE FROM chat_history WHERE id IN (SELECT id FROM chat_history WHERE chat_id = ? ORDER BY id DESC LIMIT -1 OFFSET 50)",
+            "DELETE FROM chat_history WHERE id IN (SELECT id FROM chat_history WHERE chat_id = ? ORDER BY timestamp DESC, id DESC LIMIT -1 OFFSET 50)",
             (chat_id,)
         )
         await db.commit()
@@ -49,7 +61,7 @@ async def get_history(chat_id: int, limit: int = 15):
     """获取最近的上下文"""
     async with aiosqlite.connect(DB_PATH) as db:
         async with db.execute(
-            "SELECT user_name, message FROM chat_history WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+            "SELECT user_name, message FROM chat_history WHERE chat_id = ? ORDER BY timestamp DESC, id DESC LIMIT ?",
             (chat_id, limit)
         ) as cursor:
             rows = await cursor.fetchall()
@@ -0,0 +1,342 @@
+"""
+离线数据库工具：chat_history / settings / cooldowns 的批量导出、导入（回填）
+
+    python db_tool.py export backup.jsonl.gz
+    python db_tool.py export - --chat-id -100123 --since 2024-01-01 > part.jsonl
+    python db_tool.py import backup.jsonl.gz --db shard2.db
+
+每行一个 JSON：{"table": "...", "row": {...}}，文件名以 .gz 结尾时自动 gzip 压缩。
+读取按 rowid 分批进行，写入时先在内存中攒够 --commit-every 行，再在一个短事务中批量插入，
+等待输入期间不持有写锁，内存占用恒定。数据库为 WAL 模式时可在机器人运行期间直接使用。
+
+指定 --chat-id 时默认只处理 chat_history；settings / cooldowns 是全局数据，
+需要显式 --tables 才会导出或覆盖。
+
+导入不是原子操作：中途失败时已提交的批次会保留。chat_history 默认按
+(chat_id, timestamp, user_name, message) 去重，settings / cooldowns 按主键覆盖，
+因此修正输入后重新运行同一文件是安全的。导入的旧消息拿到新 id，
+机器人按 timestamp 排序和清理历史，不会把它们当成最新上下文。
+
+--drop-indexes 只用于机器人未使用的目标库：先删除二级索引（含 idx_chat_history_chat），
+直接插入后用一条 DELETE 统一去重（目标库中原有的重复记录也会被合并），
+再重建索引，全部在同一事务内完成，失败时整体回滚。
+"""
+import argparse
+import gzip
+import json
+import logging
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from database import DB_PATH, SCHEMA
+
+logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# 表名 -> 列、时间列、chat_id 列（过滤条件只作用于存在对应列的表）
+TABLES = {
+    "chat_history": {
+        "columns": ("id", "chat_id", "user_name", "message", "timestamp"),
+        "time": "timestamp",
+        "chat": "chat_id",
+    },
+    "settings": {"columns": ("key", "value"), "time": None, "chat": None},
+    "cooldowns": {"columns": ("user_id", "last_time"), "time": "last_time", "chat": None},
+}
+
+BUSY_TIMEOUT = 30  # 等待机器人写锁的最长时间（秒）
+
+
+def parse_time(value: str) -> float:
+    """接受 Unix 时间戳或 ISO 日期（如 2024-01-01 / 2024-01-01T12:00）"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无法解析时间：{value}")
+
+
+def open_stream(path: str, mode: str):
+    if path == "-":
+        return sys.stdout if mode == "w" else sys.stdin
+    if path.endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8", compresslevel=6)
+    return open(path, mode, encoding="utf-8")
+
+
+def connect(db_path: str, readonly: bool = False) -> sqlite3.Connection:
+    # isolation_level=None：由我们手动控制事务，每次分批读取/写入都是独立的短事务，
+    # 不会长时间占住 WAL 快照或写锁
+    if readonly:
+        if not Path(db_path).is_file():
+            raise SystemExit(f"数据库不存在：{db_path}")
+        target = Path(db_path).resolve().as_uri() + "?mode=ro"
+    else:
+        target = db_path
+    conn = sqlite3.connect(target, timeout=BUSY_TIMEOUT, isolation_level=None, uri=readonly)
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT * 1000}")
+
+    has_tables = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' LIMIT 1").fetchone()
+    mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if has_tables and mode.lower() != "wal":
+        logger.warning(f"{db_path} 的 journal_mode 为 {mode} 而非 wal，机器人运行期间使用可能互相阻塞")
+    return conn
+
+
+def build_filter(table: str, args) -> tuple[str, list]:
+    spec = TABLES[table]
+    clauses, params = [], []
+    if spec["chat"] and args.chat_id:
+        clauses.append(f"{spec['chat']} IN ({','.join('?' * len(args.chat_id))})")
+        params.extend(args.chat_id)
+    if spec["time"] and args.since is not None:
+        clauses.append(f"{spec['time']} >= ?")
+        params.append(args.since)
+    if spec["time"] and args.until is not None:
+        clauses.append(f"{spec['time']} < ?")
+        params.append(args.until)
+    return "".join(f" AND {c}" for c in clauses), params
+
+
+def row_matches(table: str, row: dict, args) -> bool:
+    """导入时使用的过滤条件，与 build_filter 语义一致"""
+    spec = TABLES[table]
+    if spec["chat"] and args.chat_id and row.get(spec["chat"]) not in args.chat_id:
+        return False
+    if spec["time"] and (args.since is not None or args.until is not None):
+        ts = row.get(spec["time"])
+        if ts is None:
+            return False
+        ts = float(ts)  # 非数值时抛出 ValueError / TypeError，由调用方报告格式错误
+        if args.since is not None and ts < args.since:
+            return False
+        if args.until is not None and ts >= args.until:
+            return False
+    return True
+
+
+def report(action: str, table: str, rows: int, started: float):
+    elapsed = max(time.monotonic() - started, 1e-9)
+    logger.info(f"{action} {table}：{rows} 行，{elapsed:.2f} 秒，{rows / elapsed:.0f} 行/秒")
+
+
+# ────────────────────────────────
+# 导出
+# ────────────────────────────────
+def export_tables(args):
+    conn = connect(args.db, readonly=True)
+    try:
+        existing = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        missing = [t for t in args.tables if t not in existing]
+        if missing:
+            raise SystemExit(f"{args.db} 中缺少表：{', '.join(missing)}")
+
+        # 确认数据库可读后再打开输出，避免出错时截断已有文件
+        out = open_stream(args.file, "w")
+        total, total_started = 0, time.monotonic()
+        try:
+            for table in args.tables:
+                columns = TABLES[table]["columns"]
+                where, params = build_filter(table, args)
+                sql = (
+                    f"SELECT rowid, {', '.join(columns)} FROM {table} "
+                    f"WHERE rowid > ?{where} ORDER BY rowid LIMIT ?"
+                )
+                rows, started, last_rowid = 0, time.monotonic(), -(2 ** 63)
+                while True:
+                    batch = conn.execute(sql, (last_rowid, *params, args.batch_size)).fetchall()
+                    if not batch:
+                        break
+                    for record in batch:
+                        out.write(json.dumps(
+                            {"table": table, "row": dict(zip(columns, record[1:]))},
+                            ensure_ascii=False,
+                        ))
+                        out.write("\n")
+                    last_rowid = batch[-1][0]
+                    rows += len(batch)
+                report("导出", table, rows, started)
+                total += rows
+        finally:
+            if out is not sys.stdout:
+                out.close()
+    finally:
+        conn.close()
+    report("导出", "全部", total, total_started)
+
+
+# ────────────────────────────────
+# 导入 / 回填
+# ────────────────────────────────
+def insert_sql(table: str, keep_ids: bool, dedupe: bool) -> tuple[str, tuple]:
+    columns = TABLES[table]["columns"]
+    if table == "chat_history" and not keep_ids:
+        # 默认由目标库重新分配 id；按内容去重，重复运行不会产生重复记录
+        columns = columns[1:]
+        sql = "INSERT INTO chat_history (chat_id, user_name, message, timestamp) "
+        if not dedupe:
+            # --drop-indexes：直接插入，导入结束后统一去重
+            return sql + "VALUES (:chat_id, :user_name, :message, :timestamp)", columns
+        return sql + (
+            "SELECT :chat_id, :user_name, :message, :timestamp WHERE NOT EXISTS ("
+            "SELECT 1 FROM chat_history WHERE chat_id IS :chat_id AND timestamp IS :timestamp "
+            "AND user_name IS :user_name AND message IS :message)"
+        ), columns
+    placeholders = ", ".join(f":{c}" for c in columns)
+    return f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", columns
+
+
+def drop_indexes(conn: sqlite3.Connection, tables) -> list:
+    """删除目标表上的二级索引（含 idx_chat_history_chat），返回重建语句"""
+    marks = ",".join("?" * len(tables))
+    indexes = conn.execute(
+        f"SELECT name, sql FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL AND tbl_name IN ({marks})",
+        list(tables),
+    ).fetchall()
+    for name, _ in indexes:
+        conn.execute(f'DROP INDEX "{name}"')
+    return [sql for _, sql in indexes]
+
+
+def import_tables(args):
+    if args.file != "-" and not Path(args.file).is_file():
+        raise SystemExit(f"输入文件不存在：{args.file}")
+
+    conn = connect(args.db)
+    fresh = not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' LIMIT 1").fetchone()
+    if fresh:
+        # 新建的目标库与 init_db 一致使用 WAL
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    for statement in SCHEMA:
+        conn.execute(statement)
+
+    statements = {t: insert_sql(t, args.keep_ids, not args.drop_indexes) for t in args.tables}
+    buffers = {t: [] for t in args.tables}
+    counts = {t: 0 for t in args.tables}
+    skipped, buffered, queued = 0, 0, 0
+    started = time.monotonic()
+    source = None
+
+    def flush():
+        # --drop-indexes 时整个导入处于同一事务中，否则每次写入单独开短事务
+        nonlocal buffered, queued
+        if not args.drop_indexes:
+            conn.execute("BEGIN IMMEDIATE")
+        for table, rows in buffers.items():
+            sql, _ = statements[table]
+            for i in range(0, len(rows), args.batch_size):
+                counts[table] += conn.executemany(sql, rows[i:i + args.batch_size]).rowcount
+            queued += len(rows)
+            rows.clear()
+        if args.drop_indexes:
+            logger.info(f"已写入（未提交）{sum(counts.values())} 行")
+        else:
+            conn.execute("COMMIT")
+            logger.info(f"已导入 {sum(counts.values())} 行")
+        buffered = 0
+
+    try:
+        if args.drop_indexes:
+            # 仅用于离线目标库：删除索引、导入、去重、重建在同一事务内完成，
+            # 失败或进程被杀时回滚，索引不会丢失
+            conn.execute("BEGIN IMMEDIATE")
+            index_sql = drop_indexes(conn, args.tables)
+        source = open_stream(args.file, "r")
+        for line_no, line in enumerate(source, 1):
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                table, row = item["table"], item["row"]
+                if not isinstance(row, dict):
+                    raise TypeError
+                if table not in statements or not row_matches(table, row, args):
+                    skipped += 1
+                    continue
+            except (ValueError, KeyError, TypeError):
+                raise SystemExit(f"第 {line_no} 行格式错误")
+            buffers[table].append({c: row.get(c) for c in statements[table][1]})
+            buffered += 1
+            if buffered >= args.commit_every:
+                flush()
+        flush()
+        if args.drop_indexes:
+            if "chat_history" in statements and not args.keep_ids:
+                # 索引重建前一次性去重，语义与逐行 NOT EXISTS 一致
+                counts["chat_history"] -= conn.execute(
+                    "DELETE FROM chat_history WHERE rowid NOT IN ("
+                    "SELECT MIN(rowid) FROM chat_history GROUP BY chat_id, timestamp, user_name, message)"
+                ).rowcount
+            for sql in index_sql:
+                conn.execute(sql)
+            conn.execute("COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            try:
+                conn.execute("ROLLBACK")
+            except sqlite3.Error:
+                logger.exception("回滚失败")
+        raise
+    finally:
+        if source is not None and source is not sys.stdin:
+            source.close()
+        conn.close()
+
+    # 各表交错写入同一批事务，只统计总吞吐
+    for table in args.tables:
+        logger.info(f"导入 {table}：{counts[table]} 行")
+    written = sum(counts.values())
+    if queued > written:
+        logger.info(f"跳过 {queued - written} 行（重复记录）")
+    if skipped:
+        logger.info(f"跳过 {skipped} 行（表未选中或不符合过滤条件）")
+    report("导入", "全部", written, started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="chat_history / settings / cooldowns 批量导出导入工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    for name, help_text in (("export", "导出为 JSONL（.gz 自动压缩）"), ("import", "从 JSONL 导入 / 回填")):
+        p = sub.add_parser(name, help=help_text)
+        p.add_argument("file", help="JSONL 文件路径，- 表示标准输入/输出")
+        p.add_argument("--db", default=DB_PATH, help=f"数据库路径（默认 {DB_PATH}）")
+        p.add_argument("--tables", nargs="+", choices=list(TABLES),
+                       help="要处理的表（默认全部；指定 --chat-id 时默认只有 chat_history）")
+        p.add_argument("--chat-id", type=int, action="append", help="只处理指定 chat_id 的聊天记录，可重复")
+        p.add_argument("--since", type=parse_time, help="起始时间（含），Unix 时间戳或 ISO 日期")
+        p.add_argument("--until", type=parse_time, help="结束时间（不含），Unix 时间戳或 ISO 日期")
+        p.add_argument("--batch-size", type=int, default=5000, help="每批读取 / 插入的行数")
+
+    p_import = sub.choices["import"]
+    p_import.add_argument("--commit-every", type=int, default=50000, help="每个写事务包含的行数")
+    p_import.add_argument("--keep-ids", action="store_true", help="保留 chat_history 原 id（冲突时覆盖）")
+    p_import.add_argument("--drop-indexes", action="store_true",
+                          help="导入期间删除二级索引并在单个事务内完成，仅用于机器人未使用的目标库")
+
+    args = parser.parse_args()
+    if args.batch_size <= 0:
+        parser.error("--batch-size 必须大于 0")
+    if args.command == "import" and args.commit_every < args.batch_size:
+        parser.error("--commit-every 必须不小于 --batch-size")
+
+    if args.tables is None:
+        args.tables = ["chat_history"] if args.chat_id else list(TABLES)
+    elif args.chat_id and set(args.tables) - {"chat_history"}:
+        logger.warning("--chat-id 只作用于 chat_history，settings / cooldowns 将按全局数据处理")
+
+    if args.command == "export":
+        export_tables(args)
+    else:
+        import_tables(args)
+
+
+if __name__ == "__main__":
+    main()